@@ -1,14 +1,24 @@
 import os
+import argparse
 import json
-import glob
+import functools
 import textwrap
+import threading
 import gspread
 
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
 from google import genai
 from google.genai import types
 from google.oauth2.service_account import Credentials
 from dotenv import load_dotenv
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 load_dotenv()
 
 # GEMINI_API_KEY: Google Gemini API key
@@ -17,85 +27,221 @@ load_dotenv()
 # INVOICE_BASE_DIR: Base directory containing raw invoice image files 
 # INVOICE_OUTPUT_DIR: Output directory for parsed invoices
 
+# Gemini's structured output (response_schema) already returns JSON shaped by
+# the invoice schema, so responses are not deep-validated after parsing.
+
+MAX_PARSE_WORKERS = 8
+MAX_UPLOAD_WORKERS = 8
+SHEETS_APPEND_CHUNK_SIZE = 500
+# Images up to this many bytes in total are sent inline (base64 adds about a
+# third, keeping requests under Gemini's 20MB inline limit); the rest are uploaded
+INLINE_IMAGES_MAX_BYTES = 15 * 1024 * 1024
+IMAGE_MIME_TYPES = {
+    'png': 'image/png',
+    'jpg': 'image/jpeg',
+    'jp2': 'image/jp2',
+    'jpeg': 'image/jpeg',
+    'gif': 'image/gif',
+    'bmp': 'image/bmp',
+    'tiff': 'image/tiff',
+}
+IMAGE_EXTENSIONS = frozenset(IMAGE_MIME_TYPES)
+
+
+def _identity(value):
+    return value
+
+
+def _object_handler(schema):
+    """Builds a handler that fills an object's properties in schema order."""
+    if not schema.properties:
+        return lambda value: value if isinstance(value, dict) else {}
+    fields = [(prop_name, _build_dispatch(prop_schema)) for prop_name, prop_schema in schema.properties.items()]
+
+    def fill_object(value):
+        if not isinstance(value, dict):
+            value = {}
+        get = value.get
+        return {prop_name: handler(get(prop_name)) for prop_name, handler in fields}
+
+    return fill_object
+
+
+def _array_handler(schema):
+    """Builds a handler that fills the dict items of an array."""
+    if not schema.items:
+        # Without an items schema there is nothing to fill; keep the list as-is
+        return lambda value: list(value) if isinstance(value, list) else []
+    items_schema = schema.items
+    if items_schema.type == genai.types.Type.OBJECT and items_schema.properties:
+        fill_item = _object_handler(items_schema)
+    elif items_schema.type == genai.types.Type.ARRAY and items_schema.items:
+        fill_item = lambda item: []
+    else:
+        return lambda value: list(value) if isinstance(value, list) else []
+
+    def fill_array(value):
+        if not isinstance(value, list):
+            return []
+        return [fill_item(item) if type(item) is dict else item for item in value]
+
+    return fill_array
+
+
+_HANDLER_BUILDERS = {
+    genai.types.Type.OBJECT: _object_handler,
+    genai.types.Type.ARRAY: _array_handler,
+}
+
+
+def _build_dispatch(schema):
+    """Builds a handler tree that fills every schema field of a value."""
+    builder = _HANDLER_BUILDERS.get(schema.type)
+    return builder(schema) if builder else _identity
+
+
 def ensure_all_fields_present(data, schema):
     """Ensures all schema fields are present in the data."""
-    if not isinstance(data, dict):
-        data = {}
-    output_data = {}
-    if schema.type == genai.types.Type.OBJECT and schema.properties:
-        for prop_name, prop_schema in schema.properties.items():
-            if prop_name in data:
-                prop_value = data[prop_name]
-                if prop_schema.type in [genai.types.Type.OBJECT, genai.types.Type.ARRAY]:
-                    if isinstance(prop_value, dict):
-                        output_data[prop_name] = ensure_all_fields_present(prop_value, prop_schema)
-                    elif isinstance(prop_value, list) and prop_schema.items:
-                        output_data[prop_name] = [ensure_all_fields_present(item, prop_schema.items) if isinstance(item, dict) else item for item in prop_value]
-                    else:
-                        output_data[prop_name] = ensure_all_fields_present({}, prop_schema) if prop_schema.type == genai.types.Type.OBJECT else [] if prop_schema.type == genai.types.Type.ARRAY else None
-                else:
-                    output_data[prop_name] = prop_value
-            else:
-                if prop_schema.type == genai.types.Type.OBJECT:
-                    output_data[prop_name] = ensure_all_fields_present({}, prop_schema)
-                elif prop_schema.type == genai.types.Type.ARRAY:
-                    output_data[prop_name] = []
-                else:
-                    output_data[prop_name] = None
-        return output_data
-    elif schema.type == genai.types.Type.ARRAY and schema.items:
-        if isinstance(data, list):
-            return [ensure_all_fields_present(item, schema.items) if isinstance(item, dict) else item for item in data]
-        else:
-            return []
-    return data
+    handler = _SCHEMA_DISPATCH if schema is _INVOICE_SCHEMA else _build_dispatch(schema)
+    return handler(data)
+
+
+_INVOICE_SCHEMA = genai.types.Schema(
+    type=genai.types.Type.OBJECT,
+    properties={
+        "invoice_number": genai.types.Schema(
+            type=genai.types.Type.STRING,
+            description="The unique identifier for the invoice"
+        ),
+        "invoice_date": genai.types.Schema(
+            type=genai.types.Type.STRING,
+            description="The date the invoice was issued"
+        ),
+        "vendor": genai.types.Schema(
+            type=genai.types.Type.OBJECT,
+            properties={
+                "name": genai.types.Schema(type=genai.types.Type.STRING, description="Vendor company name (either S.J. Distributors or L&T or A Farm)"),
+                "address": genai.types.Schema(type=genai.types.Type.STRING, description="Vendor address"),
+                "tel": genai.types.Schema(type=genai.types.Type.STRING, description="Vendor contact phone number")
+            }
+        ),
+        "ship_to": genai.types.Schema(
+            type=genai.types.Type.OBJECT,
+            properties={
+                "name": genai.types.Schema(type=genai.types.Type.STRING, description="Restaurant name (e.g. DAN MODERN CHINESE #4)"),
+                "location": genai.types.Schema(type=genai.types.Type.STRING, description="Extracted location name from the ship_to name (either PLAYA VISTA, SAWTELLE, SANTA MONICA, MANHATTAN BEACH, PASADENA, LONG BEACH, TOPANGA VILLAGE)"),
+                "address": genai.types.Schema(type=genai.types.Type.STRING, description="Restaurant address"),
+            }
+        ),
+        "line_items": genai.types.Schema(
+            type=genai.types.Type.ARRAY,
+            items=genai.types.Schema(
+                type=genai.types.Type.OBJECT,
+                properties={
+                    "item_name": genai.types.Schema(type=genai.types.Type.STRING, description="Name of the item"),
+                    "total_weight": genai.types.Schema(type=genai.types.Type.NUMBER, description="Total Weight"),
+                    "unit_measure": genai.types.Schema(type=genai.types.Type.STRING, description="Unit of measurement (e.g., cs, bg, pk, etc.)"),
+                    "quantity": genai.types.Schema(type=genai.types.Type.NUMBER, description="Quantity of the item"),
+                    "unit_price": genai.types.Schema(type=genai.types.Type.NUMBER, description="Price per unit"),
+                    "total_price": genai.types.Schema(type=genai.types.Type.NUMBER, description="Total price for the line item"),
+                }
+            )
+        )
+    }
+)
+
+_SCHEMA_DISPATCH = _build_dispatch(_INVOICE_SCHEMA)
+
+_GEN_CONFIG = types.GenerateContentConfig(
+    temperature=0.2,
+    top_p=0.95,
+    top_k=40,
+    max_output_tokens=8192,
+    response_mime_type="application/json",
+    response_schema=_INVOICE_SCHEMA
+)
 
+_PROMPT_TEXT = textwrap.dedent(
+    """
+    Parse this invoice and provide the output as a JSON object according to the schema.
+    Extract all relevant details including line items.
+    """
+)
 
-def parse_invoice(image_paths):
-    """Parse all images of an invoice into a structured JSON."""
-    client = genai.Client(api_key=os.getenv('GEMINI_API_KEY'))
 
+_genai_client = None
+_genai_client_lock = threading.Lock()
+
+
+def _get_genai_client():
+    """Returns the Gemini client shared by all parse_invoice calls, creating it on first use."""
+    global _genai_client
+    if _genai_client is None:
+        with _genai_client_lock:
+            if _genai_client is None:
+                _genai_client = genai.Client(api_key=os.getenv('GEMINI_API_KEY'))
+    return _genai_client
+
+
+def _read_image_part(img_path, mime_type):
+    """Reads a small image into an inline request part."""
+    with open(img_path, 'rb') as f:
+        data = f.read()
+    print(f"Inlined file {img_path} ({len(data)} bytes)")
+    return types.Part.from_bytes(data=data, mime_type=mime_type)
+
+
+def _upload_image_part(client, img_path):
+    """Uploads an image through the Files API and returns a part referencing it."""
+    uploaded_file = client.files.upload(file=img_path)
+    file_uri, mime_type = uploaded_file.uri, uploaded_file.mime_type
+    print(f"Uploaded file {img_path} to {file_uri}")
+    return types.Part.from_uri(file_uri=file_uri, mime_type=mime_type)
+
+
+def parse_invoice(image_paths, strict_fill=False):
+    """Parse all images of an invoice into a structured JSON.
+
+    Set strict_fill to fill every schema field missing from the response with null.
+    """
     if not image_paths:
         print("No image files provided to parse_invoice function!")
         return None
 
+    client = _get_genai_client()
+
     print(f"parse_invoice received image_paths: {image_paths}")
 
-    # Upload all files
-    files = []
-    for img_path in image_paths:
-        try:
-            uploaded_file = client.files.upload(file=img_path)
-            files.append(uploaded_file)
-            print(f"Uploaded file {img_path} to {uploaded_file.uri}")
-        except Exception as e:
-            print(f"Error uploading file {img_path}: {e}")
+    # Inline small images and upload the rest concurrently, keeping page order
+    inline_budget = INLINE_IMAGES_MAX_BYTES
+    with ThreadPoolExecutor(max_workers=min(MAX_UPLOAD_WORKERS, len(image_paths))) as executor:
+        futures = []
+        for img_path in image_paths:
+            mime_type = IMAGE_MIME_TYPES.get(img_path.rpartition('.')[2].lower())
+            try:
+                size = os.path.getsize(img_path)
+            except OSError:
+                size = None
+            if mime_type and size is not None and size <= inline_budget:
+                inline_budget -= size
+                futures.append(executor.submit(_read_image_part, img_path, mime_type))
+            else:
+                futures.append(executor.submit(_upload_image_part, client, img_path))
+
+    parts = []
+    for img_path, future in zip(image_paths, futures):
+        error = future.exception()
+        if error is not None:
+            print(f"Error loading file {img_path}: {error}")
             continue
+        parts.append(future.result())
 
-    if not files:
-        print("No files were successfully uploaded for OCR.")
+    if not parts:
+        print("No files were successfully loaded for OCR.")
         return None
 
     model = "gemini-2.0-flash"
-    parts = []
-    for file in files:
-        parts.append(
-            types.Part.from_uri(
-                file_uri=file.uri,
-                mime_type=file.mime_type,
-            )
-        )
-
-    parts.append(
-        types.Part.from_text(
-            text=textwrap.dedent(
-                f"""
-                Parse this invoice and provide the output as a JSON object according to the schema.
-                Extract all relevant details including line items.
-                """
-            )
-        )
-    )
+    parts.append(types.Part.from_text(text=_PROMPT_TEXT))
 
     contents = [
         types.Content(
@@ -104,67 +250,16 @@ def parse_invoice(image_paths):
         )
     ]
 
-    invoice_schema = genai.types.Schema(
-        type=genai.types.Type.OBJECT,
-        properties={
-            "invoice_number": genai.types.Schema(
-                type=genai.types.Type.STRING,
-                description="The unique identifier for the invoice"
-            ),
-            "invoice_date": genai.types.Schema(
-                type=genai.types.Type.STRING,
-                description="The date the invoice was issued"
-            ),
-            "vendor": genai.types.Schema(
-                type=genai.types.Type.OBJECT,
-                properties={
-                    "name": genai.types.Schema(type=genai.types.Type.STRING, description="Vendor company name (either S.J. Distributors or L&T or A Farm)"),
-                    "address": genai.types.Schema(type=genai.types.Type.STRING, description="Vendor address"),
-                    "tel": genai.types.Schema(type=genai.types.Type.STRING, description="Vendor contact phone number")
-                }
-            ),
-            "ship_to": genai.types.Schema(
-                type=genai.types.Type.OBJECT,
-                properties={
-                    "name": genai.types.Schema(type=genai.types.Type.STRING, description="Restaurant name (e.g. DAN MODERN CHINESE #4)"),
-                    "location": genai.types.Schema(type=genai.types.Type.STRING, description="Extracted location name from the ship_to name (either PLAYA VISTA, SAWTELLE, SANTA MONICA, MANHATTAN BEACH, PASADENA, LONG BEACH, TOPANGA VILLAGE)"),
-                    "address": genai.types.Schema(type=genai.types.Type.STRING, description="Restaurant address"),
-                }
-            ),
-            "line_items": genai.types.Schema(
-                type=genai.types.Type.ARRAY,
-                items=genai.types.Schema(
-                    type=genai.types.Type.OBJECT,
-                    properties={
-                        "item_name": genai.types.Schema(type=genai.types.Type.STRING, description="Name of the item"),
-                        "total_weight": genai.types.Schema(type=genai.types.Type.NUMBER, description="Total Weight"),
-                        "unit_measure": genai.types.Schema(type=genai.types.Type.STRING, description="Unit of measurement (e.g., cs, bg, pk, etc.)"),
-                        "quantity": genai.types.Schema(type=genai.types.Type.NUMBER, description="Quantity of the item"),
-                        "unit_price": genai.types.Schema(type=genai.types.Type.NUMBER, description="Price per unit"),
-                        "total_price": genai.types.Schema(type=genai.types.Type.NUMBER, description="Total price for the line item"),
-                    }
-                )
-            )
-        }
-    )
-
-    generate_content_config = types.GenerateContentConfig(
-        temperature=0.2,
-        top_p=0.95,
-        top_k=40,
-        max_output_tokens=8192,
-        response_mime_type="application/json",
-        response_schema=invoice_schema
-    )
-
     try:
         response = client.models.generate_content(
             model=model,
             contents=contents,
-            config=generate_content_config,
+            config=_GEN_CONFIG,
         )
-        invoice_data = json.loads(response.text)
-        invoice_data = ensure_all_fields_present(invoice_data, invoice_schema)
+        # orjson.JSONDecodeError subclasses json.JSONDecodeError
+        invoice_data = orjson.loads(response.text) if orjson is not None else json.loads(response.text)
+        if strict_fill:
+            invoice_data = ensure_all_fields_present(invoice_data, _INVOICE_SCHEMA)
         return invoice_data
 
     except json.JSONDecodeError as e:
@@ -179,60 +274,141 @@ def parse_invoice(image_paths):
 def find_invoice_image_files(base_dir):
     """Finds all invoice image files in the base directory and subdirectories."""
     image_files = []
-    
-    for root, dirs, files in os.walk(base_dir):
-        for file in files:
-            # Check for images
-            if any(glob.fnmatch.fnmatch(file.lower(), ext) for ext in ['*.png', '*.jpg', '*.jp2', '*.jpeg', '*.gif', '*.bmp', '*.tiff']):
-                image_files.append(os.path.join(root, file))
-    
+    pending_dirs = [base_dir]
+
+    while pending_dirs:
+        try:
+            entries = os.scandir(pending_dirs.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending_dirs.append(entry.path)
+                    continue
+                # Check for images, skipping symlinked directories, FIFOs and sockets
+                if not entry.is_file():
+                    continue
+                _, dot, ext = entry.name.rpartition('.')
+                if dot and ext.lower() in IMAGE_EXTENSIONS:
+                    image_files.append(entry.path)
+
     image_files.sort()
     return image_files
 
 
+# Line item fields in Google Sheets column order
+_LINE_ITEM_KEYS = ("item_name", "quantity", "total_weight", "unit_measure", "unit_price", "total_price")
+
+
 def json_to_tabular_data(invoice_data):
     """Transforms invoice JSON data to tabular format."""
     rows = []
-    if invoice_data and invoice_data.get("line_items") and isinstance(invoice_data["line_items"], list):
+    if isinstance(invoice_data, dict) and invoice_data.get("line_items") and isinstance(invoice_data["line_items"], list):
+        # Without strict_fill, sub-objects may be null or missing in the response
+        vendor = invoice_data.get("vendor")
+        vendor = vendor if isinstance(vendor, dict) else {}
+        ship_to = invoice_data.get("ship_to")
+        ship_to = ship_to if isinstance(ship_to, dict) else {}
         invoice_number = invoice_data.get("invoice_number", "")
         invoice_date = invoice_data.get("invoice_date", "")
-        vendor_name = invoice_data.get("vendor", {}).get("name", "")
-        shipto_name = invoice_data.get("ship_to", {}).get("name", "")
-        dmc_location = invoice_data.get("ship_to", {}).get("location", "")
+        vendor_name = vendor.get("name", "")
+        shipto_name = ship_to.get("name", "")
+        dmc_location = ship_to.get("location", "")
 
+        invoice_columns = [invoice_number, invoice_date, vendor_name, shipto_name, dmc_location]
         for item in invoice_data["line_items"]:
-                row_data = [
-                    invoice_number,
-                    invoice_date,
-                    vendor_name,
-                    shipto_name,
-                    dmc_location,
-                    item.get("item_name", ""),
-                    item.get("quantity", ""),
-                    item.get("total_weight", ""),
-                    item.get("unit_measure", ""),
-                    item.get("unit_price", ""),
-                    item.get("total_price", "")
-                ]
-                rows.append(row_data)
+            if not isinstance(item, dict):
+                continue
+            get = item.get
+            rows.append(invoice_columns + [get(key, "") for key in _LINE_ITEM_KEYS])
     return rows
 
 
-def load_to_google_sheets_gspread(tabular_data, spreadsheet_id, sheet_name, service_account_file):
-    """Loads tabular data to Google Sheets using gspread."""
+@functools.lru_cache(maxsize=1)
+def _get_sheet(spreadsheet_id, sheet_name, service_account_file):
+    """Returns an authorized gspread worksheet, reused across calls."""
     scopes = ['https://www.googleapis.com/auth/spreadsheets']
     creds = Credentials.from_service_account_file(service_account_file, scopes=scopes)
     client = gspread.authorize(creds)
     spreadsheet = client.open_by_key(spreadsheet_id)
-    sheet = spreadsheet.worksheet(sheet_name)
-    sheet.append_rows(tabular_data)
+    return spreadsheet.worksheet(sheet_name)
+
+
+def load_to_google_sheets_gspread(tabular_data, spreadsheet_id, sheet_name, service_account_file):
+    """Loads tabular data to Google Sheets using gspread."""
+    sheet = _get_sheet(spreadsheet_id, sheet_name, service_account_file)
+    for start in range(0, len(tabular_data), SHEETS_APPEND_CHUNK_SIZE):
+        sheet.append_rows(tabular_data[start:start + SHEETS_APPEND_CHUNK_SIZE])
+
+
+_created_dirs = set()
+
+
+def _ensure_dir(path):
+    """Creates a directory once per run."""
+    if path not in _created_dirs:
+        os.makedirs(path, exist_ok=True)
+        _created_dirs.add(path)
+
+
+def _invoice_output_path(image_file, base_dir, output_dir, keep_extension=False):
+    """Returns the JSON output path mirroring the image's location under base_dir."""
+    relative_path = os.path.relpath(image_file, base_dir)
+    if not keep_extension:
+        relative_path = os.path.splitext(relative_path)[0]
+    return os.path.join(output_dir, f"{relative_path}.json")
+
+
+def _load_cached_invoice(image_file, output_path):
+    """Returns the saved invoice JSON if it is at least as new as its image, else None."""
+    try:
+        if os.path.getmtime(output_path) < os.path.getmtime(image_file):
+            return None
+        if orjson is not None:
+            with open(output_path, 'rb') as f:
+                return orjson.loads(f.read())
+        with open(output_path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _handle_parsed_invoice(image_file, output_path, invoice_data, cached=False):
+    """Saves a parsed invoice to JSON and returns its rows for Google Sheets."""
+    invoice_id = os.path.splitext(os.path.basename(image_file))[0]
+    if invoice_data:
+        if cached:
+            print(f"Using cached parsed invoice {output_path}")
+        else:
+            _ensure_dir(os.path.dirname(output_path))
+            if orjson is not None:
+                with open(output_path, 'wb') as f:
+                    f.write(orjson.dumps(invoice_data, option=orjson.OPT_INDENT_2))
+            else:
+                with open(output_path, 'w', encoding='utf-8') as f:
+                    json.dump(invoice_data, f, ensure_ascii=False, indent=2, sort_keys=False)
+            print(f"Saved parsed invoice to {output_path}")
+
+        tabular_data = json_to_tabular_data(invoice_data)
+        if not tabular_data:
+            print(f"No tabular data generated for invoice {invoice_id}")
+        return tabular_data
+    else:
+        print(f"Failed to parse image {image_file}")
+        return []
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Parse invoice images with Gemini and load them to Google Sheets.")
+    parser.add_argument("--force", action="store_true", help="Re-parse invoices even if their JSON output is up to date")
+    parser.add_argument("--strict-fill", action="store_true", help="Fill every schema field missing from Gemini's response with null")
+    args = parser.parse_args()
+
     base_dir = os.environ.get("INVOICE_BASE_DIR", "invoices")  
     output_dir = os.environ.get("INVOICE_OUTPUT_DIR", "parsed_invoices")  
 
-    os.makedirs(output_dir, exist_ok=True)
+    _ensure_dir(output_dir)
 
     image_files = find_invoice_image_files(base_dir)
     if not image_files:
@@ -243,39 +419,44 @@ def main():
     print(f"Images: {image_files}")
 
 
-    # Process invoice image files
-    for image_file in image_files:
-        print(f"\n--- Processing image: {image_file} ---")
-        invoice_id = os.path.splitext(os.path.basename(image_file))[0]
-        
-        invoice_data = parse_invoice([image_file])
-        if invoice_data:
-            relative_path = os.path.relpath(image_file, base_dir)
-            output_sub_dir = os.path.dirname(relative_path)
-            output_file_dir = os.path.join(output_dir, output_sub_dir)
-            os.makedirs(output_file_dir, exist_ok=True)
-            
-            output_filename = f"{invoice_id}.json"
-            output_path = os.path.join(output_file_dir, output_filename)
-            
-            with open(output_path, 'w', encoding='utf-8') as f:
-                json.dump(invoice_data, f, ensure_ascii=False, indent=2, sort_keys=False)
-            print(f"Saved parsed invoice to {output_path}")
-            
-            tabular_data = json_to_tabular_data(invoice_data)
-            if tabular_data:
-                spreadsheet_id = os.environ.get("GOOGLE_SHEETS_ID")
-                sheet_name = "Invoice data"
-                service_account_file = os.environ.get("SERVICE_ACCOUNT_FILE")
-                if spreadsheet_id and service_account_file:
-                    load_to_google_sheets_gspread(tabular_data, spreadsheet_id, sheet_name, service_account_file)
-                    print(f"Data for invoice {invoice_id} loaded to Google Sheet")
-                else:
-                    print(f"Missing environment variables for Google Sheets integration")
+    # Parse invoice image files concurrently; saving and Sheets loading stay on the main thread
+    all_rows = []
+    with ThreadPoolExecutor(max_workers=MAX_PARSE_WORKERS) as executor:
+        # Images sharing a stem in one folder (x.png, x.jpg) keep their extension in the output name
+        stem_counts = Counter(os.path.splitext(image_file)[0] for image_file in image_files)
+        pending = []
+        for image_file in image_files:
+            keep_extension = stem_counts[os.path.splitext(image_file)[0]] > 1
+            output_path = _invoice_output_path(image_file, base_dir, output_dir, keep_extension)
+            # Reuse JSON saved by an earlier run unless the image has changed since
+            cached_data = None if args.force else _load_cached_invoice(image_file, output_path)
+            fresh_cache = True
+            if cached_data and args.strict_fill:
+                # Saved output may come from a run without --strict-fill; fill it and save it again if needed
+                filled_data = ensure_all_fields_present(cached_data, _INVOICE_SCHEMA)
+                fresh_cache = filled_data == cached_data and list(filled_data) == list(cached_data)
+                cached_data = filled_data
+            future = None if cached_data else executor.submit(parse_invoice, [image_file], strict_fill=args.strict_fill)
+            pending.append((image_file, output_path, cached_data, fresh_cache, future))
+
+        # Collect results in file order so rows reach the sheet in a stable order
+        for image_file, output_path, cached_data, fresh_cache, future in pending:
+            print(f"\n--- Processing image: {image_file} ---")
+            if future is None:
+                all_rows.extend(_handle_parsed_invoice(image_file, output_path, cached_data, cached=fresh_cache))
             else:
-                print(f"No tabular data generated for invoice {invoice_id}")
+                all_rows.extend(_handle_parsed_invoice(image_file, output_path, future.result()))
+
+    # Load all rows to Google Sheets in one batch
+    if all_rows:
+        spreadsheet_id = os.environ.get("GOOGLE_SHEETS_ID")
+        sheet_name = "Invoice data"
+        service_account_file = os.environ.get("SERVICE_ACCOUNT_FILE")
+        if spreadsheet_id and service_account_file:
+            load_to_google_sheets_gspread(all_rows, spreadsheet_id, sheet_name, service_account_file)
+            print(f"{len(all_rows)} rows loaded to Google Sheet")
         else:
-            print(f"Failed to parse image {image_file}")
+            print(f"Missing environment variables for Google Sheets integration")
 
     print("\nProcessing completed for all files.")
 